@@ -17,7 +17,6 @@
 import glob
 import os
 import json
-import yaml
 import subprocess
 import sys
 import errno
@@ -26,7 +25,8 @@ import tempfile
 from functools import wraps
 from subprocess import CalledProcessError
 from distutils.version import LooseVersion
-from charms.tool.utils import cached, flush, Config, charm_dir, atexit
+from charms.model.utils import (
+    cached, flush, Config, charm_dir, atexit, _atexit)
 
 
 CRITICAL = "CRITICAL"
@@ -136,8 +136,11 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
         # stdin, but that feature is broken in 1.23.2: Bug #1454678.
+        import yaml
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
         with tempfile.NamedTemporaryFile(delete=False) as settings_file:
-            settings_file.write(yaml.safe_dump(settings).encode("utf-8"))
+            settings_file.write(
+                yaml.dump(settings, Dumper=dumper).encode("utf-8"))
         subprocess.check_call(
             relation_cmd_line + ["--file", settings_file.name])
         os.remove(settings_file.name)
@@ -225,8 +228,10 @@ def relations_of_type(reltype=None):
 @cached
 def metadata():
     """Get the current charm metadata.yaml contents as a python object"""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(os.path.join(charm_dir(), 'metadata.yaml')) as md:
-        return yaml.safe_load(md)
+        return yaml.load(md, Loader=loader)
 
 
 @cached
@@ -692,7 +697,6 @@ def has_juju_version(minimum_version):
     return LooseVersion(juju_version()) >= LooseVersion(minimum_version)
 
 
-_atexit = []
 _atstart = []
 
 
@@ -1,22 +1,81 @@
 import os
+import sys
+import errno
+import atexit
+import itertools
 import subprocess
-from charms.model.utils import cached
+from functools import lru_cache
+from charms.model.utils import cached, json_loads, Config
+
+_JUJU_LOG = ('juju-log',)
+_STATUS_SET = ('status-set',)
+_CONFIG_GET = ('config-get', '--format=json')
+_STATUS_GET = ('status-get', '--format=json', '--include-data')
+_VALID_STATES = frozenset(('maintenance', 'blocked', 'waiting', 'active'))
+
+# Linux limits a single argument to 128 KiB, stay well below that.
+_LOG_BATCH_SIZE = 64 * 1024
+
+_log_buffer = []
 
 
 def log(message, level=None):
-    """Write a message to the juju log"""
-    command = ['juju-log']
-    if level:
-        command += ['-l', level]
+    """Write a message to the juju log
+
+    Messages are buffered and sent to juju-log when the process exits, or
+    before the next status_set(). Use log_immediate() for messages which
+    must be written straight away.
+    """
     if not isinstance(message, str):
         message = repr(message)
-    command += [message]
+    _log_buffer.append((level, message))
+
+
+def log_immediate(message, level=None):
+    """Write a message to the juju log, along with any buffered messages"""
+    log(message, level)
+    _flush_logs()
+
+
+def _flush_logs():
+    """Send buffered log messages to juju-log, one call per run of
+    consecutive messages sharing a level"""
+    messages = _log_buffer[:]
+    del _log_buffer[:]
+    for level, group in itertools.groupby(messages, key=lambda m: m[0]):
+        for batch in _log_batches(message for _, message in group):
+            _juju_log(batch, level)
+
+
+def _log_batches(messages):
+    """Split messages into lists which fit in a single juju-log argument"""
+    batch, size = [], 0
+    for message in messages:
+        # Measure as subprocess will encode it, surrogate escapes included.
+        length = len(os.fsencode(message)) + 1
+        if batch and size + length > _LOG_BATCH_SIZE:
+            yield batch
+            batch, size = [], 0
+        batch.append(message)
+        size += length
+    if batch:
+        yield batch
+
+
+def _juju_log(messages, level):
+    """Send messages to juju-log as one newline separated message, falling
+    back to one call per message if the command line is too long"""
+    message = '\n'.join(messages)
+    command = _JUJU_LOG + (('-l', level) if level else ()) + (message,)
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
     try:
         subprocess.call(command)
     except OSError as e:
-        if e.errno == errno.ENOENT:
+        if e.errno == errno.E2BIG and len(messages) > 1:
+            for message in messages:
+                _juju_log([message], level)
+        elif e.errno in (errno.ENOENT, errno.E2BIG):
             if level:
                 message = "{}: {}".format(level, message)
             message = "juju-log: {}".format(message)
@@ -25,33 +84,53 @@ def log(message, level=None):
             raise
 
 
+atexit.register(_flush_logs)
+
+
+@lru_cache(maxsize=1)
 def name():
     """Local unit ID"""
     return os.environ['JUJU_UNIT_NAME']
 
 
+@lru_cache(maxsize=1)
 def hook_name():
     """The name of the currently executing hook"""
     return os.environ.get('JUJU_HOOK_NAME', os.path.basename(sys.argv[0]))
 
 
-@cached
-def config(scope=None):
-    """Juju charm configuration"""
-    config_cmd_line = ['config-get']
-    if scope is not None:
-        config_cmd_line.append(scope)
-    config_cmd_line.append('--format=json')
+@cached(pin=True)
+def _config_get():
+    """The complete charm configuration, fetched with a single config-get"""
     try:
-        config_data = json.loads(
-            subprocess.check_output(config_cmd_line).decode('UTF-8'))
-        if scope is not None:
-            return config_data
-        return Config(config_data)
+        return json_loads(subprocess.check_output(_CONFIG_GET))
     except ValueError:
         return None
 
 
+def config(scope=None):
+    """Juju charm configuration
+
+    Lookups are served from a single config-get per hook, so asking for a
+    key that is not in the charm config returns None without running
+    config-get again. Use flush('config') to fetch the config afresh.
+    """
+    if scope is None:
+        return _config()
+    config_data = _config_get()
+    if config_data is None:
+        return None
+    return config_data.get(scope)
+
+
+@cached(pin=True)
+def _config():
+    config_data = _config_get()
+    if config_data is None:
+        return None
+    return Config(config_data)
+
+
 def status_set(workload_state, message):
     """Set the workload state with a message
 
@@ -62,12 +141,16 @@ def status_set(workload_state, message):
     workload_state -- valid juju workload state.
     message        -- status update message
     """
-    valid_states = ['maintenance', 'blocked', 'waiting', 'active']
-    if workload_state not in valid_states:
+    if workload_state not in _VALID_STATES:
         raise ValueError(
             '{!r} is not a valid workload state'.format(workload_state)
         )
-    cmd = ['status-set', workload_state, message]
+    try:
+        _flush_logs()
+    except OSError as e:
+        # Failing to log must not stop the status from being set.
+        print("juju-log: {}".format(e), file=sys.stderr)
+    cmd = _STATUS_SET + (workload_state, message)
     try:
         ret = subprocess.call(cmd)
         if ret == 0:
@@ -87,14 +170,13 @@ def status_get():
     return 'unknown', ""
 
     """
-    cmd = ['status-get', "--format=json", "--include-data"]
     try:
-        raw_status = subprocess.check_output(cmd)
+        raw_status = subprocess.check_output(_STATUS_GET)
     except OSError as e:
         if e.errno == errno.ENOENT:
             return ('unknown', "")
         else:
             raise
     else:
-        status = json.loads(raw_status.decode("UTF-8"))
+        status = json_loads(raw_status)
         return (status["status"], status["message"])
\ No newline at end of file
@@ -1,15 +1,39 @@
 
 import os
 import copy
+import stat
 import json
-import yaml
+import warnings
 
 from functools import wraps
-from collections import UserDict
+from collections import OrderedDict, defaultdict
+
+try:
+    import orjson
+except ImportError:
+    json_loads = json.loads
+else:
+    def json_loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which json.dumps() writes.
+            return json.loads(data)
 
-cache = {}
+CACHE_SIZE = 256
+cache = OrderedDict()
 MARKER = object()
 
+# Reverse indexes used by flush(), from function name and from str() of
+# each argument to the cache keys they appear in.
+_by_func = defaultdict(set)
+_by_arg = defaultdict(set)
+_fragments = {}
+# Cache keys which are never evicted, only flushed.
+_pinned = set()
+
+_atexit = []
+
 
 def charm_dir():
     """Return the root directory of the current charm"""
@@ -23,7 +47,7 @@ def atexit(callback, *args, **kwargs):
     _atexit.append((callback, args, kwargs))
 
 
-def cached(func):
+def cached(func=None, pin=False):
     """Cache return values for multiple executions of func + args
 
     For example::
@@ -35,70 +59,131 @@ def cached(func):
         unit_get('test')
 
     will cache the result of unit_get + 'test' for future calls.
+
+    At most ``CACHE_SIZE`` results are kept, the least recently used
+    being discarded first. Results which hold per-hook state, and must
+    stay the same object until flushed, can be exempted with::
+
+        @cached(pin=True)
+        def config():
+            pass
     """
+    if func is None:
+        return lambda func: cached(func, pin=pin)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = str((func, args, kwargs))
+        kwitems = tuple(sorted(kwargs.items()))
+        # Include the types so that f(1), f(1.0) and f(True) stay apart.
+        key = (func, args, kwitems, tuple(map(type, args)),
+               tuple(type(v) for _, v in kwitems))
         try:
-            return cache[key]
-        except KeyError:
-            pass  # Drop out of the exception handler scope.
+            res = cache.get(key, MARKER)
+        except TypeError:
+            # Unhashable arguments, fall back to their representation.
+            key = str(key)
+            res = cache.get(key, MARKER)
+        if res is not MARKER:
+            cache.move_to_end(key)
+            return res
         res = func(*args, **kwargs)
         cache[key] = res
+        arg_strs = set(str(arg) for arg in args + tuple(kwargs.values()))
+        _fragments[key] = (func.__name__, arg_strs)
+        _by_func[func.__name__].add(key)
+        for arg_str in arg_strs:
+            _by_arg[arg_str].add(key)
+        if pin:
+            _pinned.add(key)
+        elif len(cache) - len(_pinned) > CACHE_SIZE:
+            _forget(next(k for k in cache if k not in _pinned))
         return res
     wrapper._wrapped = func
     return wrapper
 
 
-def flush(key):
-    """Flushes any entries from function cache where the
-    key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
+def _unindex(index, fragment, key):
+    keys = index[fragment]
+    keys.discard(key)
+    if not keys:
+        del index[fragment]
+
+
+def _forget(key):
+    """Remove a single entry from the function cache and its indexes"""
+    del cache[key]
+    _pinned.discard(key)
+    func_name, arg_strs = _fragments.pop(key)
+    _unindex(_by_func, func_name, key)
+    for arg_str in arg_strs:
+        _unindex(_by_arg, arg_str, key)
+
+
+def flush(key, partial=False):
+    """Flushes any entries from function cache where the key is part of
+    the function name or equal to one of the arguments.
+
+    With ``partial=True`` entries where the key is part of an argument are
+    flushed too. This scans every cached argument and is deprecated.
+    """
+    flush_list = set()
+    for func_name, keys in _by_func.items():
+        if key in func_name:
+            flush_list.update(keys)
+    if partial:
+        warnings.warn('flush() matching part of an argument is '
+                      'deprecated, pass the whole argument',
+                      DeprecationWarning, stacklevel=2)
+        for arg_str, keys in _by_arg.items():
+            if key in arg_str:
+                flush_list.update(keys)
+    else:
+        flush_list.update(_by_arg.get(key, ()))
     for item in flush_list:
-        del cache[item]
+        _forget(item)
 
 
-class Serializable(UserDict):
+class Serializable(dict):
     """Wrapper, an object that can be serialized to yaml or json"""
 
+    __slots__ = ('data',)
+
     def __init__(self, obj):
-        # wrap the object
-        UserDict.__init__(self)
-        self.data = obj
+        super(Serializable, self).__init__(obj)
+        self.data = self
 
     def __getattr__(self, attr):
-        # See if this object has attribute.
-        if attr in ("json", "yaml", "data"):
-            return self.__dict__[attr]
-        # Check for attribute in wrapped object.
-        got = getattr(self.data, attr, MARKER)
-        if got is not MARKER:
-            return got
-        # Proxy to the wrapped object via dict interface.
-        try:
-            return self.data[attr]
-        except KeyError:
+        # Only called once normal lookup fails, proxy to the dict interface.
+        got = self.get(attr, MARKER)
+        if got is MARKER:
             raise AttributeError(attr)
+        return got
+
+    def __reduce__(self):
+        # Rebuild through __init__ so copies and pickles get the alias.
+        return (self.__class__, (dict(self),))
 
     def __getstate__(self):
         # Pickle as a standard dictionary.
-        return self.data
+        return dict(self)
 
     def __setstate__(self, state):
-        # Unpickle into our wrapper.
-        self.data = state
+        # Unpickle into our wrapper. This also loads protocol 2+ pickles of
+        # the old UserDict based class; protocol 0 and 1 ones cannot load,
+        # as they create the instance with object.__new__().
+        self.update(state)
+        self.data = self
 
     def json(self):
         """Serialize the object to json"""
-        return json.dumps(self.data)
+        return json.dumps(self)
 
     def yaml(self):
         """Serialize the object to yaml"""
-        return yaml.dump(self.data)
+        # PyYAML is slow to import and only needed here.
+        import yaml
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        return yaml.dump(dict(self), Dumper=dumper, default_flow_style=False)
 
 
 class Config(dict):
@@ -146,8 +231,10 @@ class Config(dict):
         self.implicit_save = True
         self._prev_dict = None
         self.path = os.path.join(charm_dir(), Config.CONFIG_FILE_NAME)
-        if os.path.exists(self.path):
+        try:
             self.load_previous()
+        except FileNotFoundError:
+            pass
         atexit(self._implicit_save)
 
     def load_previous(self, path=None):
@@ -165,11 +252,12 @@ class Config(dict):
 
         """
         self.path = path or self.path
-        with open(self.path) as f:
-            self._prev_dict = json.load(f)
-        for k, v in copy.deepcopy(self._prev_dict).items():
+        with open(self.path, 'rb') as f:
+            self._prev_dict = json.loads(f.read())
+        for k, v in self._prev_dict.items():
             if k not in self:
-                self[k] = v
+                # Copy so that in-place changes still show up in changed().
+                self[k] = copy.deepcopy(v)
 
     def changed(self, key):
         """Return True if the current value for this key is different from
@@ -201,9 +289,29 @@ class Config(dict):
         instance.
 
         """
-        with open(self.path, 'w') as f:
-            json.dump(self, f)
+        data = json.dumps(self).encode('UTF-8')
+        try:
+            mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            mode = None
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                if mode is not None:
+                    # Keep the permissions of the file being replaced, it
+                    # may hold secrets.
+                    os.fchmod(f.fileno(), mode)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
 
     def _implicit_save(self):
-        if self.implicit_save:
+        if self.implicit_save and self._prev_dict != self:
             self.save()
@@ -0,0 +1,129 @@
+import io
+import errno
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from charms.model import unit, utils
+
+
+@utils.cached
+def _other(value):
+    return value
+
+
+class ConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        utils.flush('')
+        del utils._atexit[:]
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        patcher = mock.patch.dict('os.environ', {'CHARM_DIR': self.charm_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('subprocess.check_output',
+                             return_value=b'{"foo": "bar"}')
+        self.check_output = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_config_scope(self):
+        self.assertEqual(unit.config('foo'), 'bar')
+        self.assertIsNone(unit.config('missing'))
+        self.assertEqual(unit.config(), {'foo': 'bar'})
+        self.check_output.assert_called_once_with(
+            ('config-get', '--format=json'))
+
+    def test_config_survives_cache_eviction(self):
+        c1 = unit.config()
+        c1['mykey'] = 'val'
+        for i in range(utils.CACHE_SIZE + 44):
+            _other(i)
+        c2 = unit.config()
+        self.assertIs(c1, c2)
+        self.assertEqual(len(utils._atexit), 1)
+        self.assertEqual(self.check_output.call_count, 1)
+
+    def test_flush_config(self):
+        c1 = unit.config()
+        utils.flush('config')
+        self.assertIsNot(unit.config(), c1)
+        self.assertEqual(self.check_output.call_count, 2)
+
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self):
+        del unit._log_buffer[:]
+        patcher = mock.patch('subprocess.call', return_value=0)
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def commands(self):
+        return [c[0][0] for c in self.call.call_args_list]
+
+    def test_log_is_buffered(self):
+        unit.log('one')
+        self.assertFalse(self.call.called)
+        unit._flush_logs()
+        self.assertEqual(self.commands(), [('juju-log', 'one')])
+        unit._flush_logs()
+        self.assertEqual(self.call.call_count, 1)
+
+    def test_batches_keep_order(self):
+        unit.log('a')
+        unit.log('b')
+        unit.log(1, level='DEBUG')
+        unit.log('c')
+        unit.log_immediate('d', level='ERROR')
+        self.assertEqual(self.commands(), [
+            ('juju-log', 'a\nb'),
+            ('juju-log', '-l', 'DEBUG', '1'),
+            ('juju-log', 'c'),
+            ('juju-log', '-l', 'ERROR', 'd'),
+        ])
+
+    def test_surrogate_escaped_message(self):
+        unit.log('first')
+        unit.log('file \udcff')
+        unit.status_set('active', 'ready')
+        self.assertEqual(self.commands(), [
+            ('juju-log', 'first\nfile \udcff'),
+            ('status-set', 'active', 'ready'),
+        ])
+
+    def test_status_set_flushes_first(self):
+        unit.log('before')
+        unit.status_set('active', 'ready')
+        self.assertEqual(self.commands(), [
+            ('juju-log', 'before'),
+            ('status-set', 'active', 'ready'),
+        ])
+
+    @mock.patch.object(unit, '_LOG_BATCH_SIZE', 10)
+    def test_batches_are_size_limited(self):
+        for message in ('1234', '5678', '9abc', 'defghijklmnop'):
+            unit.log(message)
+        unit._flush_logs()
+        self.assertEqual(self.commands(), [
+            ('juju-log', '1234\n5678'),
+            ('juju-log', '9abc'),
+            ('juju-log', 'defghijklmnop'),
+        ])
+
+    def test_argument_too_long(self):
+        def call(command):
+            if len(command[-1]) > 100:
+                raise OSError(errno.E2BIG, 'Argument list too long')
+            return 0
+        self.call.side_effect = call
+        messages = ['line {}'.format(i).ljust(60) for i in range(3)]
+        for message in messages:
+            unit.log(message)
+        unit.log('x' * 200)
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            unit.status_set('active', 'ready')
+        sent = [c[-1] for c in self.commands() if len(c[-1]) <= 100]
+        self.assertEqual(sent, messages + ['ready'])
+        self.assertEqual(stderr.getvalue(), 'juju-log: {}\n'.format('x' * 200))
@@ -0,0 +1,266 @@
+import os
+import pickle
+import errno
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+from charms.model import utils
+
+
+calls = []
+
+
+@utils.cached
+def relation_get(attribute=None, unit=None):
+    calls.append(('relation_get', attribute, unit))
+    return attribute
+
+
+@utils.cached
+def _config_get():
+    calls.append(('_config_get',))
+    return {}
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        utils.flush('')
+        del calls[:]
+
+    def assertIndexEmpty(self):
+        self.assertEqual(len(utils.cache), 0)
+        self.assertEqual(utils._fragments, {})
+        self.assertEqual(utils._by_func, {})
+        self.assertEqual(utils._by_arg, {})
+        self.assertEqual(utils._pinned, set())
+
+    def test_cached(self):
+        relation_get('a', unit='u/0')
+        relation_get('a', unit='u/0')
+        relation_get(attribute='a', unit='u/0')
+        self.assertEqual(len(calls), 2)
+
+    def test_equal_arguments_of_different_types(self):
+        for value in (1, 1.0, True, 1, 1.0, True):
+            self.assertIs(type(relation_get(value)), type(value))
+            self.assertIs(type(relation_get(unit=value)), type(None))
+        self.assertEqual(len(calls), 6)
+
+    def test_unhashable_arguments(self):
+        self.assertEqual(relation_get(['a']), ['a'])
+        relation_get(['a'])
+        self.assertEqual(len(calls), 1)
+        utils.flush("['a']")
+        self.assertIndexEmpty()
+
+    def test_flush_exact_argument(self):
+        relation_get('a', unit='u/0')
+        relation_get('b', unit='u/1')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            utils.flush('u/0')
+        relation_get('a', unit='u/0')
+        relation_get('b', unit='u/1')
+        self.assertEqual(calls, [('relation_get', 'a', 'u/0'),
+                                 ('relation_get', 'b', 'u/1'),
+                                 ('relation_get', 'a', 'u/0')])
+
+    def test_flush_function_name(self):
+        relation_get('a')
+        _config_get()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            utils.flush('config')
+        relation_get('a')
+        _config_get()
+        self.assertEqual(calls, [('relation_get', 'a', None),
+                                 ('_config_get',),
+                                 ('_config_get',)])
+
+    def test_flush_partial_argument_is_opt_in(self):
+        for units in (('u/0', 'u/0-x'), ('u/0-x', 'u/0')):
+            utils.flush('')
+            for unit in units:
+                relation_get('a', unit=unit)
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                utils.flush('u/0')
+            self.assertEqual([k[2] for k in utils.cache],
+                             [(('unit', 'u/0-x'),)])
+            utils.flush('u/')
+            self.assertEqual(len(utils.cache), 1)
+
+    def test_flush_partial_argument_is_deprecated(self):
+        for units in (('u/0', 'u/0-x'), ('u/0-x', 'u/0')):
+            utils.flush('')
+            for unit in units:
+                relation_get('a', unit=unit)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                utils.flush('u/0', partial=True)
+            self.assertEqual([w.category for w in caught],
+                             [DeprecationWarning])
+            self.assertIndexEmpty()
+
+    def test_flush_no_match(self):
+        relation_get('a')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            utils.flush('zzz')
+        self.assertEqual(caught, [])
+        self.assertEqual(len(utils.cache), 1)
+
+    @mock.patch.object(utils, 'CACHE_SIZE', 3)
+    def test_eviction_cleans_index(self):
+        for i in range(5):
+            relation_get(str(i), unit='u/{}'.format(i))
+        relation_get('2', unit='u/2')
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(sorted(utils._by_arg),
+                         ['2', '3', '4', 'u/2', 'u/3', 'u/4'])
+        self.assertEqual(len(utils._by_func['relation_get']), 3)
+        self.assertEqual(set(utils._fragments), set(utils.cache))
+        relation_get('5')
+        self.assertNotIn('3', utils._by_arg)
+        utils.flush('relation_get')
+        self.assertIndexEmpty()
+
+    @mock.patch.object(utils, 'CACHE_SIZE', 2)
+    def test_pinned_entries_are_not_evicted(self):
+        pinned = utils.cached(pin=True)(lambda: object())
+        first = pinned()
+        for i in range(5):
+            relation_get(str(i))
+        self.assertIs(pinned(), first)
+        self.assertEqual(len(utils.cache), 3)
+        utils.flush('<lambda>')
+        self.assertIsNot(pinned(), first)
+
+
+class SerializableTest(unittest.TestCase):
+
+    def test_yaml(self):
+        s = utils.Serializable({'a': [1, 2], 'b': {'c': 'x'}})
+        self.assertEqual(s.yaml(), 'a:\n- 1\n- 2\nb:\n  c: x\n')
+
+    def test_pickle(self):
+        s = utils.Serializable({'a': 1})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            t = pickle.loads(pickle.dumps(s, protocol))
+            self.assertIs(type(t), utils.Serializable)
+            self.assertEqual(t, s)
+            self.assertIs(t.data, t)
+
+    def test_unpickle_userdict_version(self):
+        # Protocol 2 pickle of Serializable({'a': 1}) when it was based on
+        # UserDict.
+        t = pickle.loads(b'\x80\x02ccharms.model.utils\nSerializable\nq\x00)'
+                         b'\x81q\x01}q\x02X\x01\x00\x00\x00aq\x03K\x01sb.')
+        self.assertEqual(t, {'a': 1})
+        self.assertIs(t.data, t)
+        self.assertEqual(t.a, 1)
+
+    def test_json(self):
+        s = utils.Serializable({'a': 1, 'b': [1, 2]})
+        self.assertEqual(s.json(), '{"a": 1, "b": [1, 2]}')
+
+    def test_import_does_not_load_yaml(self):
+        code = ('import sys, charms.model.unit; '
+                'sys.exit("yaml" in sys.modules)')
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(utils.__file__))))
+        self.assertEqual(
+            subprocess.call([sys.executable, '-c', code], cwd=root), 0)
+
+
+class ConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        del utils._atexit[:]
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        patcher = mock.patch.dict('os.environ', {'CHARM_DIR': self.charm_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.charm_dir, utils.Config.CONFIG_FILE_NAME)
+
+    def write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_save_and_load(self):
+        c = utils.Config({'foo': 'bar'})
+        c['mykey'] = [1]
+        c.save()
+        c = utils.Config({'foo': 'baz'})
+        self.assertEqual(c, {'foo': 'baz', 'mykey': [1]})
+        self.assertTrue(c.changed('foo'))
+        self.assertEqual(c.previous('foo'), 'bar')
+        self.assertFalse(c.changed('mykey'))
+
+    def test_save_round_trip(self):
+        values = {'nan': float('nan'), 'inf': float('inf'),
+                  '-inf': float('-inf'), 'big': 2 ** 70, 'neg': -2 ** 70,
+                  'surrogate': 'file \udcff'}
+        c = utils.Config({})
+        c.update(values)
+        c.save()
+        c = utils.Config({})
+        self.assertNotEqual(c['nan'], c['nan'])
+        del c['nan'], values['nan']
+        self.assertEqual(c, values)
+        self.assertIs(type(c['big']), int)
+
+    def test_load_nan(self):
+        self.write('{"ratio": NaN}')
+        c = utils.Config({})
+        self.assertNotEqual(c['ratio'], c['ratio'])
+
+    def test_implicit_save_skipped_when_unchanged(self):
+        self.write('{"foo": "bar"}')
+        c = utils.Config({'foo': 'bar'})
+        with mock.patch.object(c, 'save') as save:
+            c._implicit_save()
+        self.assertFalse(save.called)
+
+    def test_failed_save_leaves_file_alone(self):
+        self.write('{"foo": "bar"}')
+        c = utils.Config({'foo': {1, 2}})
+        self.assertRaises(TypeError, c.save)
+        self.assertEqual(self.read(), '{"foo": "bar"}')
+        self.assertEqual(os.listdir(self.charm_dir),
+                         [utils.Config.CONFIG_FILE_NAME])
+
+    def test_failed_write_removes_temporary_file(self):
+        self.write('{"foo": "bar"}')
+        c = utils.Config({'foo': 'baz'})
+        error = OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch('os.fsync', side_effect=error):
+            self.assertRaises(OSError, c.save)
+        self.assertEqual(self.read(), '{"foo": "bar"}')
+        self.assertEqual(os.listdir(self.charm_dir),
+                         [utils.Config.CONFIG_FILE_NAME])
+
+    def test_implicit_save_large_int(self):
+        c = utils.Config({})
+        c['big'] = 2 ** 70
+        c._implicit_save()
+        self.assertEqual(utils.Config({})['big'], 2 ** 70)
+
+    def test_save_keeps_mode(self):
+        self.write('{}')
+        os.chmod(self.path, 0o600)
+        c = utils.Config({'password': 'secret'})
+        c.save()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)